@@ -4,15 +4,14 @@ import warnings
 from abc import abstractmethod
 from contextlib import contextmanager
 import copy
-import traceback as tb
 import torch
-from typing import Sequence, Union, Mapping, List, Dict
+from typing import Sequence, Union, Mapping, List, Dict, Tuple
 from xitorch._utils.exceptions import GetSetParamsError
 from xitorch._utils.attr import get_attr, set_attr, del_attr
 
 __all__ = ["EditableModule"]
 
-torch_float_type = [torch.float32, torch.float, torch.float64, torch.float16]
+torch_float_type = frozenset([torch.float32, torch.float64, torch.float16, torch.bfloat16])
 
 class EditableModule(object):
     def getparams(self, methodname:str) -> Sequence[torch.Tensor]:
@@ -48,16 +47,14 @@ class EditableModule(object):
         return [allparams[i] for i in idxs]
 
     def setuniqueparams(self, methodname:str, *uniqueparams) -> int:
-        nparams = self._number_of_params[methodname]
-        allparams = [None for _ in range(nparams)]
-        maps = self._unique_params_maps[methodname]
-
-        for j in range(len(uniqueparams)):
-            jmap = maps[j]
-            p = uniqueparams[j]
-            for i in jmap:
-                allparams[i] = p
-
+        plan = self._unique_params_plans[methodname]
+        # if all the parameters are unique, they can be set directly
+        if plan is None:
+            return self.setparams(methodname, *uniqueparams)
+
+        allparams = [None] * self._number_of_params[methodname]
+        for i, j in plan:
+            allparams[i] = uniqueparams[j]
         return self.setparams(methodname, *allparams)
 
     def _get_unique_params_idxs(self, methodname:str,
@@ -65,7 +62,7 @@ class EditableModule(object):
 
         if not hasattr(self, "_unique_params_idxs"):
             self._unique_params_idxs = {} # type: Dict[str,List[int]]
-            self._unique_params_maps = {}
+            self._unique_params_plans = {} # type: Dict[str,Union[List[Tuple[int,int]],None]]
             self._number_of_params = {}
 
         if methodname in self._unique_params_idxs:
@@ -74,43 +71,42 @@ class EditableModule(object):
             allparams = self.getparams(methodname)
 
         # get the unique ids
-        ids = [] # type: List[int]
+        id_to_j = {} # type: Dict[int,int]
         idxs = []
         idx_map = [] # type: List[List[int]]
-        for i in range(len(allparams)):
-            param = allparams[i]
-            id_param = id(param)
-
+        for i, param in enumerate(allparams):
             # search the id if it has been added to the list
-            try:
-                jfound = ids.index(id_param)
+            jfound = id_to_j.get(id(param), None)
+            if jfound is not None:
                 idx_map[jfound].append(i)
                 continue
-            except ValueError:
-                pass
 
-            ids.append(id_param)
+            id_to_j[id(param)] = len(idxs)
             idxs.append(i)
             idx_map.append([i])
 
         self._number_of_params[methodname] = len(allparams)
         self._unique_params_idxs[methodname] = idxs
-        self._unique_params_maps[methodname] = idx_map
+        # list of (i, j) where the i-th parameter is the j-th unique parameter,
+        # or None if all the parameters are unique
+        if len(idxs) == len(allparams):
+            self._unique_params_plans[methodname] = None
+        else:
+            self._unique_params_plans[methodname] = [(i, j) for j, js in enumerate(idx_map) for i in js]
         return idxs
 
     @contextmanager
     def useuniqueparams(self, methodname:str, *params):
+        _orig_params_ = self.getuniqueparams(methodname)
+        if _all_equal(_orig_params_, params):
+            yield self
+            return
+
         try:
-            _orig_params_ = self.getuniqueparams(methodname)
-            identical = _all_equal(_orig_params_, params)
-            if not identical:
-                self.setuniqueparams(methodname, *params)
+            self.setuniqueparams(methodname, *params)
             yield self
-        except Exception as exc:
-            raise exc
         finally:
-            if not identical:
-                self.setuniqueparams(methodname, *_orig_params_)
+            self.setuniqueparams(methodname, *_orig_params_)
 
     ############# debugging #############
     def assertparams(self, method, *args, **kwargs):
@@ -236,9 +232,9 @@ class EditableModule(object):
         copy_tensors = copy.copy(copy_tensors0)
         _set_tensors(self, copy_tensors)
 
-        # run the method and see which one has the gradients
+        # run the method and see which one is connected to the output
         output = method(*args, **kwargs).sum()
-        grad_tensors = torch.autograd.grad(output, copy_tensors0, retain_graph=True, allow_unused=True)
+        leaf_ids = _get_graph_leaf_ids(output)
 
         # return the original tensor
         all_tensors_copy = copy.copy(all_tensors)
@@ -246,8 +242,8 @@ class EditableModule(object):
 
         names = []
         params = []
-        for i, grad in enumerate(grad_tensors):
-            if grad is None:
+        for i, tensor in enumerate(copy_tensors0):
+            if id(tensor) not in leaf_ids:
                 continue
             names.append(all_names[i])
             params.append(all_tensors[i])
@@ -278,52 +274,95 @@ def _all_equal(params1, params2):
             return False
     return True
 
+def _get_graph_leaf_ids(output):
+    # returns the ids of the leaf tensors connected to the output in the
+    # backward graph by walking the graph without performing the backward pass
+    leaf_ids = set()
+    if output.grad_fn is None:
+        return leaf_ids
+
+    visited = set()
+    fns = [output.grad_fn]
+    while len(fns) > 0:
+        fn = fns.pop()
+        if fn is None or fn in visited:
+            continue
+        visited.add(fn)
+
+        # leaf tensors are stored as the variable of AccumulateGrad nodes
+        variable = getattr(fn, "variable", None)
+        if variable is not None:
+            leaf_ids.add(id(variable))
+        fns.extend([nextfn for (nextfn, _) in fn.next_functions])
+    return leaf_ids
+
 ############################ traversing functions ############################
+_traversed_containers = (list, tuple, dict)
+
 def _traverse_obj(obj, prefix, action, crit, max_depth=20, exception_ids=None):
     """
     Traverse an object to get/set variables that are accessible through the object.
+    The traversal is done depth-first with an explicit stack instead of
+    recursive calls.
     """
     if exception_ids is None:
         # None is set as default arg to avoid expanding list for multiple
         # invokes of _get_tensors without exception_ids argument
         exception_ids = set()
 
-    if hasattr(obj, "__dict__"):
-        generator = obj.__dict__.items()
-        name_format = "{prefix}{key}"
-        objdict = obj.__dict__
-    elif hasattr(obj, "__iter__"):
-        generator = obj.items() if isinstance(obj, dict) else enumerate(obj)
-        name_format = "{prefix}[{key}]"
-        objdict = obj
-    else:
-        raise RuntimeError("The object must be iterable or keyable")
+    # stack of (generator, name_format, objdict, prefix) of the objects whose
+    # elements are being traversed
+    stack = [_get_traverse_items(obj, getattr(obj, "__dict__", None), prefix)]
+    while len(stack) > 0:
+        generator, name_format, objdict, prefix = stack[-1]
+        try:
+            key, elmt = next(generator)
+        except StopIteration:
+            stack.pop()
+            continue
 
-    for key,elmt in generator:
         name = name_format.format(prefix=prefix, key=key)
         if crit(elmt):
             action(elmt, name, objdict, key)
             continue
 
-        hasdict = hasattr(elmt, "__dict__")
-        hasiter = hasattr(elmt, "__iter__")
-        if hasdict or hasiter:
+        # non-float tensors are not traversed down
+        if isinstance(elmt, torch.Tensor):
+            continue
+
+        # only traverse down objects with __dict__ and the explicit containers
+        # (e.g. strings or generators are skipped)
+        elmtdict = getattr(elmt, "__dict__", None)
+        hasdict = elmtdict is not None
+        if hasdict or isinstance(elmt, _traversed_containers):
             # add exception to avoid infinite loop if there is a mutual dependant on objects
             if id(elmt) in exception_ids:
                 continue
             else:
                 exception_ids.add(id(elmt))
 
-            if max_depth > 0:
-                _traverse_obj(elmt,
-                    action = action,
-                    crit = crit,
-                    prefix = name+"." if hasdict else name,
-                    max_depth = max_depth - 1,
-                    exception_ids=exception_ids)
+            if len(stack) <= max_depth:
+                stack.append(_get_traverse_items(elmt, elmtdict, name+"." if hasdict else name))
             else:
                 raise RecursionError("Maximum number of recursion reached")
 
+def _get_traverse_items(obj, objdict, prefix):
+    # returns the elements generator of the object and how to name and access them
+    # objdict is obj.__dict__ or None if obj does not have __dict__
+    if objdict is not None:
+        generator = iter(objdict.items())
+        name_format = "{prefix}{key}"
+    elif isinstance(obj, _traversed_containers):
+        generator = iter(obj.items()) if isinstance(obj, dict) else enumerate(obj)
+        name_format = "{prefix}[{key}]"
+        objdict = obj
+    else:
+        raise RuntimeError("The object must be iterable or keyable")
+    return generator, name_format, objdict, prefix
+
+def _is_float_tensor(elmt):
+    return isinstance(elmt, torch.Tensor) and elmt.dtype in torch_float_type
+
 def _get_tensors(obj, prefix="", max_depth=20):
     """
     Collect all tensors in an object recursively and return the tensors as well
@@ -352,8 +391,7 @@ def _get_tensors(obj, prefix="", max_depth=20):
         names.append(name)
 
     # traverse down the object to collect the tensors
-    crit = lambda elmt: isinstance(elmt, torch.Tensor) and elmt.dtype in torch_float_type
-    _traverse_obj(obj, action=action, crit=crit, prefix=prefix, max_depth=max_depth)
+    _traverse_obj(obj, action=action, crit=_is_float_tensor, prefix=prefix, max_depth=max_depth)
     return res, names
 
 def _set_tensors(obj, all_params, max_depth=20):
@@ -373,5 +411,4 @@ def _set_tensors(obj, all_params, max_depth=20):
     def action(elmt, name, objdict, key):
         objdict[key] = all_params.pop(0)
     # traverse down the object to collect the tensors
-    crit = lambda elmt: isinstance(elmt, torch.Tensor) and elmt.dtype in torch_float_type
-    _traverse_obj(obj, action=action, crit=crit, prefix="", max_depth=max_depth)
+    _traverse_obj(obj, action=action, crit=_is_float_tensor, prefix="", max_depth=max_depth)
@@ -1,17 +1,57 @@
+import functools
 import numpy as np
 import torch
 
 # no gradient flowing in the following functions
 
-def leggaussquad(fcn, xl, xu, params, n, **unused):
-    xlg, wlg = np.polynomial.legendre.leggauss(n)
-    ndim = len(xu.shape)
-    xlg = torch.tensor(xlg, dtype=xu.dtype, device=xu.device)[(...,)+(None,)*ndim] # (n, *nx)
-    wlg = torch.tensor(wlg, dtype=xu.dtype, device=xu.device)[(...,)+(None,)*ndim] # (n, *nx)
-    wlg *= 0.5 * (xu - xl)
-    xs = xlg * (0.5 * (xu - xl)) + (0.5 * (xu + xl)) # (n, *nx)
+def leggaussquad(fcn, xl, xu, params, n, batched=False, use_vmap=False, **unused):
+    # if batched, fcn must be able to take x with shape (n, *nx) and returns
+    # output with shape (n, *nout)
+    # if use_vmap, fcn is vectorized over the nodes with torch.vmap, falling
+    # back to the loop if fcn cannot be vectorized
+    xfrac, wlg = _leggauss_cached(n, xu.dtype, xu.device) # (n,)
+    ndim = max(len(xl.shape), len(xu.shape))
+    xfrac = xfrac[(...,)+(None,)*ndim] # (n, *nx)
+    # map the nodes to [xl, xu] in a single operation
+    xs = torch.lerp(xl, xu, xfrac) # (n, *nx)
 
-    res = wlg[0] * fcn(xs[0], *params)
-    for i in range(1,n):
-        res += wlg[i] * fcn(xs[i], *params)
-    return res
+    fy = None
+    if batched:
+        fy = fcn(xs, *params) # (n, *nout)
+    elif use_vmap and hasattr(torch, "vmap"):
+        try:
+            fy = torch.vmap(lambda x: fcn(x, *params))(xs) # (n, *nout)
+        except RuntimeError:
+            pass
+
+    if fy is not None:
+        res = torch.tensordot(wlg, fy, dims=1)
+    else:
+        # weights as python numbers so the weighted sum is accumulated inplace
+        # without a temporary tensor for every node
+        wlg_np = _leggauss(n)[1]
+        res = fcn(xs[0], *params) * float(wlg_np[0])
+        for i in range(1,n):
+            res.add_(fcn(xs[i], *params), alpha=float(wlg_np[i]))
+    return res * (0.5 * (xu - xl))
+
+@functools.lru_cache(maxsize=32)
+def _leggauss(n):
+    # the nodes and weights only depend on n, so cache them to avoid
+    # recomputing the eigendecomposition for every call
+    return np.polynomial.legendre.leggauss(n)
+
+@functools.lru_cache(maxsize=64)
+def _leggauss_cached(n, dtype, device):
+    # keep the tensors of the nodes and weights on the device to avoid the
+    # host-to-device copy for every call
+    # the nodes are returned as fractions of the interval, i.e. in [0, 1]
+    # NOTE: the returned tensors are shared, so they must not be modified inplace
+    xlg, wlg = _leggauss(n)
+    res = []
+    for arr in ((xlg + 1) * 0.5, wlg):
+        tensor = torch.as_tensor(arr, dtype=dtype)
+        if device.type == "cuda":
+            tensor = tensor.pin_memory()
+        res.append(tensor.to(device, non_blocking=True))
+    return tuple(res)
@@ -40,9 +40,11 @@ class RKAdaptiveStepSolver(object):
         if direction < 0:
             self.ts = -ts
             self.func = lambda t,y: -fcn(-t, y.reshape(yshape), *params).reshape(-1)
+            self.fsign = -1
         else:
             self.ts = ts
             self.func = lambda t,y: fcn(t, y.reshape(yshape), *params).reshape(-1)
+            self.fsign = 1
         self.dtype = y0.dtype
         self.device = y0.device
         n = torch.numel(y0)
@@ -54,21 +56,46 @@ class RKAdaptiveStepSolver(object):
         self.C = self.C.to(self.dtype).to(self.device)
         self.E = self.E.to(self.dtype).to(self.device)
 
-    def solve(self):
+    def solve(self, callback=None, first_step=None, last_only=False):
         t0 = self.ts[0]
         ts = self.ts
         f0 = self.func(t0, self.y0)
-        h0 = self.ts[1] - self.ts[0] # ??? perform more intelligent guess
+        if first_step is None:
+            h0 = self.ts[1] - self.ts[0] # ??? perform more intelligent guess
+        else:
+            # the step is taken in the direction of ts, so only its size is given
+            if not first_step > 0:
+                raise RuntimeError("first_step must be positive, got %s" % first_step)
+            h0 = torch.tensor(first_step, dtype=self.ts.dtype, device=self.ts.device)
 
         # prepare the results
         nt = len(ts)
-        yt = torch.empty((len(self.ts), *self.y0.shape), dtype=self.dtype, device=self.device)
-        yt[0] = self.y0
+        if not last_only:
+            yt = torch.empty((len(self.ts), *self.y0.shape), dtype=self.dtype, device=self.device)
+            yt[0] = self.y0
 
         rk_state = (f0, t0, self.y0, h0)
         for i in range(1,len(ts)):
             rk_state = self._step(rk_state, ts[i])
-            yt[i] = rk_state[2]
+            if callback is not None:
+                # the derivative must be recalculated if the state is changed,
+                # unless it is given by the callback or there is no next step
+                _, t, y, h = rk_state
+                ynew, f = callback(i, y.reshape(self.y0.shape))
+                y = ynew.reshape(y.shape)
+                if f is not None:
+                    f = self.fsign * f.reshape(-1)
+                elif i < len(ts) - 1:
+                    f = self.func(t, y)
+                rk_state = (f, t, y, h)
+            if not last_only:
+                yt[i] = rk_state[2]
+
+        # the step size for the next step, which can be used as the first step
+        # of a following solve
+        self.last_step = float(rk_state[3])
+        if last_only:
+            return rk_state[2].reshape(self.y0.shape)
         return yt
 
     def _error_norm(self, K, h):
@@ -148,10 +175,16 @@ class RK45(RKAdaptiveStepSolver):
     E = torch.tensor([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525,
                       1/40], dtype=torch.float64)
 
-def _rk_adaptive(fcn, ts, y0, params, cls, atol=None, rtol=None, **unused):
+def _rk_adaptive(fcn, ts, y0, params, cls, atol=None, rtol=None, callback=None,
+        first_step=None, stats=None, last_only=False, **unused):
+    # first_step: the size of the first step, default to the first interval of ts
+    # stats: if a dict is given, the "last_step" is written into it
     solver = cls(atol=atol, rtol=rtol)
     solver.setup(fcn, ts, y0, params)
-    return solver.solve()
+    yt = solver.solve(callback=callback, first_step=first_step, last_only=last_only)
+    if stats is not None:
+        stats["last_step"] = solver.last_step
+    return yt
 
 def rk23_adaptive(fcn, ts, y0, params, **kwargs):
     return _rk_adaptive(fcn, ts, y0, params, RK23, **kwargs)
@@ -12,12 +12,21 @@ import torch
 #       The list of initial values
 # * params: list
 #       List of any other parameters
+# * callback: callable or None
+#       If given, it is called as `callback(i, y)` after `y` at `t[i]` is
+#       obtained and returns a tuple `(y, f)` where `y` is the value to be
+#       stored and to continue the integration from (i.e. it can apply a jump
+#       to the state) and `f` is `fcn(t[i], y, *params)` if the callback has
+#       calculated it (to be reused by the next step) or None otherwise
+# * last_only: bool
+#       If True, only the value of `y` at `t[-1]` is returned, so the values at
+#       the other time points are not stored
 # * **kwargs: dict
 #       Any other keyword arguments
 # Outputs
 # -------
 # * yt: list of torch.Tensor (nt,*ny)
-#       The value of `y` at the given time `t`
+#       The value of `y` at the given time `t` (with shape (*ny) if `last_only`)
 # Note
 # ----
 # The operations are done in grad-disabled environment and **not** expected to
@@ -25,7 +34,7 @@ import torch
 
 __all__ = ["rk4_ivp", "rk38_ivp"]
 
-def explicit_rk(tableau, fcn, t, y0, params):
+def explicit_rk(tableau, fcn, t, y0, params, callback=None, last_only=False):
     c = tableau["c"]
     a = tableau["a"]
     b = tableau["b"]
@@ -35,10 +44,11 @@ def explicit_rk(tableau, fcn, t, y0, params):
     device = t.device
 
     # set up the results list
-    yt = torch.empty((nt, *y0.shape), dtype=dtype, device=device)
-
-    yt[0] = y0
+    if not last_only:
+        yt = torch.empty((nt, *y0.shape), dtype=dtype, device=device)
+        yt[0] = y0
     y = y0
+    f = None
     # see https://en.wikipedia.org/wiki/Runge%E2%80%93Kutta_methods#Explicit_Runge.E2.80.93Kutta_methods
     # for the implementation
     for i in range(nt-1):
@@ -49,7 +59,7 @@ def explicit_rk(tableau, fcn, t, y0, params):
         ksum = 0.0
         for j in range(s):
             if j == 0:
-                k = fcn(t0, y, *params)
+                k = fcn(t0, y, *params) if f is None else f
             else:
                 ak = 0.0
                 for m in range(j):
@@ -58,8 +68,11 @@ def explicit_rk(tableau, fcn, t, y0, params):
             ks.append(k)
             ksum += b[j] * k
         y = h * ksum + y
-        yt[i+1] = y
-    return yt
+        if callback is not None:
+            y, f = callback(i+1, y)
+        if not last_only:
+            yt[i+1] = y
+    return y if last_only else yt
 
 ############################# list of tableaus #############################
 rk4_tableau = {
@@ -80,29 +93,34 @@ rk38_tableau = {
 }
 
 ############################# list of methods #############################
-def rk38_ivp(fcn, t, y0, params, **kwargs):
-    return explicit_rk(rk38_tableau, fcn, t, y0, params)
+def rk38_ivp(fcn, t, y0, params, callback=None, last_only=False, **kwargs):
+    return explicit_rk(rk38_tableau, fcn, t, y0, params, callback=callback,
+        last_only=last_only)
 
 # explicit rk4 implementation to speed up
-def rk4_ivp(fcn, t, y0, params, **kwargs):
+def rk4_ivp(fcn, t, y0, params, callback=None, last_only=False, **kwargs):
     dtype = t.dtype
     device = t.device
     nt = torch.numel(t)
 
     # set up the results
-    yt = torch.empty((nt, *y0.shape), dtype=dtype, device=device)
-
-    yt[0] = y0
+    if not last_only:
+        yt = torch.empty((nt, *y0.shape), dtype=dtype, device=device)
+        yt[0] = y0
     y = y0
+    f = None
     for i in range(nt-1):
         t0 = t[i]
         t1 = t[i+1]
         h = t1 - t0
         h2 = h * 0.5
-        k1 = fcn(t0, y, *params)
+        k1 = fcn(t0, y, *params) if f is None else f
         k2 = fcn(t0 + h2, h2 * k1 + y, *params)
         k3 = fcn(t0 + h2, h2 * k2 + y, *params)
         k4 = fcn(t0 + h , h  * k3 + y, *params)
         y = h/6. * (k1 + 2*k2 + 2*k3 + k4) + y
-        yt[i+1] = y
-    return yt
+        if callback is not None:
+            y, f = callback(i+1, y)
+        if not last_only:
+            yt[i+1] = y
+    return y if last_only else yt
@@ -34,6 +34,12 @@ class ModuleTest(EditableModule):
         self.b = b
         return self.b * 2.0
 
+    def method_no_preserve3(self, b:torch.Tensor) -> torch.Tensor:
+        # this method changes a parameter through .data (without changing
+        # the version counter of the tensor)
+        self.g.data.add_(b)
+        return self.g
+
     def method_dict_correct(self, b:torch.Tensor) -> torch.Tensor:
         return self._dummy_fcn(b) + self.dctparams[0] + self.dctparams[2]
 
@@ -68,6 +74,12 @@ class ModuleTest(EditableModule):
     def method_correct_getsetparams2(self, b:torch.Tensor, b2:torch.Tensor) -> torch.Tensor:
         return self._dummy_fcn(b) + self._dummy_fcn(b2)
 
+    def method_inner_grad(self, b:torch.Tensor) -> torch.Tensor:
+        # this method calculates a gradient inside it
+        b = b.detach().requires_grad_()
+        energy = (self._dummy_fcn(b) * b * b).sum()
+        return torch.autograd.grad(energy, b, create_graph=True)[0]
+
     def method_nontensor_getparams(self, b:torch.Tensor) -> torch.Tensor:
         return self._dummy_fcn(b)
 
@@ -85,6 +97,8 @@ class ModuleTest(EditableModule):
             return [prefix+"a"]
         elif methodname == "method_no_preserve1":
             return []
+        elif methodname == "method_no_preserve3":
+            return [prefix+"g"]
 
         elif methodname == "method_dict_correct":
             return [prefix+"a", prefix+"c", prefix+"d", prefix+"e", prefix+"dctparams[0]", prefix+"dctparams[2]"]
@@ -111,6 +125,8 @@ class ModuleTest(EditableModule):
             return [prefix+"a", prefix+"c", prefix+"d", prefix+"e"]
         elif methodname == "method_correct_getsetparams2":
             return [prefix+"a", prefix+"c", prefix+"d", prefix+"e"]
+        elif methodname == "method_inner_grad":
+            return [prefix+"a", prefix+"c", prefix+"d", prefix+"e"]
 
         elif methodname == "method_nontensor_getparams":
             return [prefix+"a", prefix+"c", prefix+"d", prefix+"e", prefix+"fint"]
@@ -135,6 +151,7 @@ def test_correct():
         "method_duplicate_excess": (b,),
         "method_dict_correct": (b,),
         "method_list_correct": (b,),
+        "method_inner_grad": (b,),
     }
     for m in correct_methods:
         model.assertparams(getattr(model, m), *correct_methods[m])
@@ -143,6 +160,7 @@ def test_error_getsetparams():
     error_methods = [
         "method_no_preserve1",
         "method_no_preserve2",
+        "method_no_preserve3",
         "method_nontensor_getparams",
     ]
     for methodname in error_methods:
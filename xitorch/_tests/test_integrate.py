@@ -1,11 +1,11 @@
 import random
+import pytest
 import torch
 import numpy as np
-from torch.autograd import gradcheck, gradgradcheck
 import xitorch as xt
 from xitorch.grad.jachess import hess
 from xitorch.integrate import quad, solve_ivp, mcquad
-from xitorch._tests.utils import device_dtype_float_test
+from xitorch._tests.utils import device_dtype_float_test, gradcheck, gradgradcheck
 
 ################################## quadrature ##################################
 class IntegrationNNModule(torch.nn.Module):
@@ -65,10 +65,18 @@ def test_quad(dtype, device):
     torch.manual_seed(100)
     random.seed(100)
     nr = 2
-    fwd_options = {
+    fwd_options_list = [{
         "method": "leggauss",
         "n": 100,
-    }
+    }, {
+        "method": "leggauss",
+        "n": 100,
+        "batched": True,
+    }, {
+        "method": "leggauss",
+        "n": 100,
+        "use_vmap": True,
+    }]
 
     a = torch.nn.Parameter(torch.rand((nr,), dtype=dtype, device=device).requires_grad_())
     b = torch.nn.Parameter(torch.randn((nr,), dtype=dtype, device=device).requires_grad_())
@@ -76,32 +84,51 @@ def test_quad(dtype, device):
     xl = torch.zeros((1,), dtype=dtype, device=device).requires_grad_()
     xu = (torch.ones ((1,), dtype=dtype, device=device) * 0.5).requires_grad_()
 
-    for clss in [IntegrationModule, IntegrationNNModule]:
-
-        module = clss(a, b)
-        y = quad(module.forward, xl, xu, params=(c,), fwd_options=fwd_options)
-        ytrue = (torch.sin(a * xu + b * c) - torch.sin(a * xl + b * c)) / a
-        assert torch.allclose(y, ytrue)
+    for fwd_options in fwd_options_list:
+        for clss in [IntegrationModule, IntegrationNNModule]:
 
-        def getloss(a, b, c, xl, xu):
             module = clss(a, b)
             y = quad(module.forward, xl, xu, params=(c,), fwd_options=fwd_options)
-            return y
+            ytrue = (torch.sin(a * xu + b * c) - torch.sin(a * xl + b * c)) / a
+            assert torch.allclose(y, ytrue)
 
-        gradcheck    (getloss, (a, b, c, xl, xu))
-        gradgradcheck(getloss, (a, b, c, xl, xu))
-        # check if not all parameters require grad
-        gradcheck    (getloss, (a, b.detach(), c, xl, xu))
+            def getloss(a, b, c, xl, xu):
+                module = clss(a, b)
+                y = quad(module.forward, xl, xu, params=(c,), fwd_options=fwd_options)
+                return y
+
+            gradcheck    (getloss, (a, b, c, xl, xu))
+            gradgradcheck(getloss, (a, b, c, xl, xu))
+            # check if not all parameters require grad
+            gradcheck    (getloss, (a, b.detach(), c, xl, xu))
+
+    # check if the function is vectorized instead of falling back to the loop
+    if hasattr(torch, "vmap"):
+        ncalls = [0]
+        def fcn(x, c):
+            ncalls[0] += 1
+            return torch.cos(x + c)
+
+        quad(fcn, xl, xu, params=(c,), fwd_options={"use_vmap": True})
+        assert ncalls[0] == 2 # one call in quad to get the output shape
 
 @device_dtype_float_test(only64=True)
 def test_quad_multi(dtype, device):
     torch.manual_seed(100)
     random.seed(100)
     nr = 4
-    fwd_options = {
+    fwd_options_list = [{
         "method": "leggauss",
         "n": 100,
-    }
+    }, {
+        "method": "leggauss",
+        "n": 100,
+        "batched": True,
+    }, {
+        "method": "leggauss",
+        "n": 100,
+        "use_vmap": True,
+    }]
 
     a = torch.nn.Parameter(torch.rand((nr,), dtype=dtype, device=device).requires_grad_())
     b = torch.nn.Parameter(torch.randn((nr,), dtype=dtype, device=device).requires_grad_())
@@ -109,14 +136,15 @@ def test_quad_multi(dtype, device):
     xl = torch.zeros((1,), dtype=dtype, device=device).requires_grad_()
     xu = (torch.ones ((1,), dtype=dtype, device=device) * 0.5).requires_grad_()
 
-    for clss in [IntegrationMultiModule, IntegrationNNMultiModule]:
-        module = clss(a, b)
-        y = quad(module.forward, xl, xu, params=(c,), fwd_options=fwd_options)
-        ytrue0 = (torch.sin(a * xu + b * c) - torch.sin(a * xl + b * c)) / a
-        ytrue1 = (-torch.cos(a * xu + b * c) + torch.cos(a * xl + b * c)) / a
-        assert len(y) == 2
-        assert torch.allclose(y[0], ytrue0)
-        assert torch.allclose(y[1], ytrue1)
+    for fwd_options in fwd_options_list:
+        for clss in [IntegrationMultiModule, IntegrationNNMultiModule]:
+            module = clss(a, b)
+            y = quad(module.forward, xl, xu, params=(c,), fwd_options=fwd_options)
+            ytrue0 = (torch.sin(a * xu + b * c) - torch.sin(a * xl + b * c)) / a
+            ytrue1 = (-torch.cos(a * xu + b * c) + torch.cos(a * xl + b * c)) / a
+            assert len(y) == 2
+            assert torch.allclose(y[0], ytrue0)
+            assert torch.allclose(y[1], ytrue1)
 
 @device_dtype_float_test(only64=True)
 def test_quad_inf(dtype, device):
@@ -204,6 +232,9 @@ def test_ivp(dtype, device):
 
         gradcheck(getoutput, (a, b, c, ts, y0))
         gradgradcheck(getoutput, (a, b, c, ts, y0))
+        # check if ts does not require grad
+        gradcheck    (getoutput, (a, b, c, ts.detach(), y0))
+        gradgradcheck(getoutput, (a, b, c, ts.detach(), y0))
 
 @device_dtype_float_test(only64=True)
 def test_ivp_methods(dtype, device):
@@ -243,6 +274,63 @@ def test_ivp_methods(dtype, device):
             yt_true = y0 * torch.exp(-(0.5 * a * (ts1 + t0) + b + c) * (ts1 - t0))
             assert torch.allclose(yt, yt_true, rtol=rtol, atol=atol)
 
+            # rk23 is not accurate enough for the default tolerance of gradcheck
+            if method != "rk23":
+                gradcheck(getoutput, (a, b, c, ts, y0))
+
+@device_dtype_float_test(only64=True)
+def test_ivp_closure_tensor(dtype, device):
+    # the function uses a tensor computed outside of it, so the graph of the
+    # tensor is shared by all the evaluations in the backward
+    torch.manual_seed(100)
+    random.seed(100)
+    nr = 2
+    nt = 5
+    a = torch.rand((nr,), dtype=dtype, device=device).requires_grad_()
+    ts = torch.linspace(0.0, 0.2, nt, dtype=dtype, device=device)
+    y0 = torch.rand((nr,), dtype=dtype, device=device)
+
+    for method in ["rk4", "rk45"]:
+        def getoutput(a):
+            a2 = a * 2
+            def fcn(t, y, a):
+                return -a2 * a * y
+            return solve_ivp(fcn, ts, y0, params=(a,), fwd_options={"method": method})
+
+        gradcheck(getoutput, (a,))
+
+@device_dtype_float_test(only64=True)
+def test_ivp_first_step(dtype, device):
+    # the backward solve starts from the last step of the adaptive forward
+    # solve, which must not change the gradient nor take more evaluations
+    # than starting from the first interval of ts
+    nt = 5
+    t1 = 10.0
+    a = torch.tensor([0.5, 1.2], dtype=dtype, device=device).requires_grad_()
+    ts = torch.linspace(0.0, t1, nt, dtype=dtype, device=device)
+    y0 = torch.tensor([1.0, 2.0], dtype=dtype, device=device)
+    nevals = [0]
+
+    def fcn(t, y, a):
+        nevals[0] += 1
+        return -a * y
+
+    bck_nevals = []
+    for bck_options in [{}, {"first_step": float(ts[1] - ts[0])}]:
+        yt = solve_ivp(fcn, ts, y0, params=(a,), bck_options=bck_options)
+        nevals[0] = 0
+        grad_a, = torch.autograd.grad(yt[-1].sum(), a)
+        bck_nevals.append(nevals[0])
+        grad_a_true = -t1 * y0 * torch.exp(-a * t1)
+        assert torch.allclose(grad_a, grad_a_true, atol=1e-5)
+    assert bck_nevals[0] <= bck_nevals[1]
+
+    # the size of the first step must be positive
+    for first_step in [0.0, -1.0]:
+        yt = solve_ivp(fcn, ts, y0, params=(a,), bck_options={"first_step": first_step})
+        with pytest.raises(RuntimeError):
+            torch.autograd.grad(yt[-1].sum(), a)
+
 ################################## mcquad ##################################
 class MCQuadLogProbNNModule(torch.nn.Module):
     def __init__(self, w):
@@ -1,11 +1,11 @@
 import itertools
 import torch
 import pytest
-from torch.autograd import gradcheck, gradgradcheck
 from xitorch.linalg.linop import LinearOperator
 from xitorch.linalg.symeig import lsymeig, symeig
 from xitorch.linalg.solve import solve
 from xitorch._utils.bcast import get_bcasted_dims
+from xitorch._tests.utils import gradcheck, gradgradcheck
 
 seed = 12345
 
@@ -1,10 +1,19 @@
+import os
+import inspect
 import torch
 import xitorch as xt
 import pytest
 import argparse
 from xitorch._utils.fd import finite_differences
 
-__all__ = ["device_dtype_float_test", "get_diagonally_dominant_class"]
+__all__ = ["device_dtype_float_test", "get_diagonally_dominant_class",
+           "gradcheck", "gradgradcheck"]
+
+# the gradient checks are performed on random projections of the jacobian
+# (fast_mode) unless XITORCH_SLOW_GRADCHECK=1 to check the full jacobian
+# fast_mode is only available for torch>=1.9
+fast_gradcheck = os.environ.get("XITORCH_SLOW_GRADCHECK", "0") != "1" and \
+    "fast_mode" in inspect.signature(torch.autograd.gradcheck).parameters
 
 def device_dtype_float_test(only64=False, onlycpu=False):
     dtypes = [torch.float, torch.float64]
@@ -22,6 +31,16 @@ def device_dtype_float_test(only64=False, onlycpu=False):
         return fcn_all
     return device_dtype_float_test_fcn
 
+def gradcheck(fcn, inputs, **kwargs):
+    if fast_gradcheck:
+        kwargs.setdefault("fast_mode", True)
+    return torch.autograd.gradcheck(fcn, inputs, **kwargs)
+
+def gradgradcheck(fcn, inputs, **kwargs):
+    if fast_gradcheck:
+        kwargs.setdefault("fast_mode", True)
+    return torch.autograd.gradgradcheck(fcn, inputs, **kwargs)
+
 def get_diagonally_dominant_class(na):
     class Acls(xt.Module):
         def __init__(self):
@@ -29,8 +48,8 @@ def get_diagonally_dominant_class(na):
 
         def forward(self, x, A1, diag):
             Amatrix = (A1 + A1.transpose(-2,-1))
-            A = Amatrix + diag.diag_embed(dim1=-2, dim2=-1)
-            y = torch.bmm(A, x)
+            # (Amatrix + diag_embed(diag)) @ x without constructing the diagonal matrix
+            y = torch.baddbmm(diag.unsqueeze(-1) * x, Amatrix, x)
             return y
 
         def precond(self, y, A1, dg, biases=None, M=None, mparams=None):
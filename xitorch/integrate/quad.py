@@ -32,7 +32,19 @@ def quad(
     * params: list
         List of any other parameters for the function `fcn`.
     * fwd_options: dict
-        Options for the forward quadrature method.
+        Options for the forward quadrature method. The available options are:
+        * method: str
+            The quadrature method. Only "leggauss" is available (default).
+        * n: int
+            The number of Legendre-Gauss nodes (default: 100).
+        * batched: bool
+            If True, `fcn` is evaluated once for all the nodes, i.e. `x` has
+            shape (n, *nx) and the output (or each of the tensors in the output
+            list) must have shape (n, *nout). Default: False.
+        * use_vmap: bool
+            If True, `fcn` is vectorized over the nodes with `torch.vmap`. If
+            `fcn` cannot be vectorized, it is evaluated node by node.
+            Default: False.
     * bck_options: dict
         Options for the backward quadrature method.
 
@@ -68,7 +80,11 @@ def quad(
         @make_sibling(pfunc)
         def pfunc2(x, *params):
             y = fcn(x, *params)
-            return packer.flatten(y)
+            # keep the node dimension if fcn is evaluated in batch
+            nbatch = y[0].ndim - out[0].ndim
+            if nbatch == 0:
+                return packer.flatten(y)
+            return torch.cat([yi.reshape(*yi.shape[:nbatch], -1) for yi in y], dim=-1)
 
         res = _Quadrature.apply(pfunc2, xl, xu, fwd_options, bck_options, nparams,
             dtype, device, *params, *pfunc.objparams())
@@ -111,6 +127,9 @@ class _Quadrature(torch.autograd.Function):
                 def fcn2(t, *params):
                     ys = fcn(tfm.forward(t), *params)
                     dxdt = tfm.dxdt(t)
+                    if config.get("batched", False):
+                        # dxdt: (n, *nx) -> (n, 1, ..., 1) to broadcast with ys
+                        dxdt = dxdt.reshape(dxdt.shape[0], *([1] * (ys.ndim - 1)))
                     return ys * dxdt
 
                 tl = tfm.x2t(xl)
@@ -181,11 +200,15 @@ class _Quadrature(torch.autograd.Function):
                     create_graph=torch.is_grad_enabled())
                 return dfdts
 
+            # new_fcn cannot be evaluated in batch or vectorized as the
+            # gradients are accumulated over the batch dimension
+            bck_config = set_default_option(dict(ctx.bck_config), {"batched": False, "use_vmap": False})
+
             # reconstruct grad_params
             # listing tensor_params in the params of quad to make sure it gets
             # the gradient calculated
             dydts = quad(new_fcn, xl, xu, params=(grad_ys, *tensor_params),
-                         fwd_options=ctx.bck_config, bck_options=ctx.bck_config)
+                         fwd_options=bck_config, bck_options=bck_config)
             dydns = [None for _ in range(ctx.param_sep.nnontensors())]
             grad_params = ctx.param_sep.reconstruct_params(dydts, dydns)
 
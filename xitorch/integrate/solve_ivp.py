@@ -35,9 +35,20 @@ def solve_ivp(fcn:Callable[...,torch.Tensor],
     * params: list
         List of other parameters required in the function.
     * fwd_options: dict
-        Options for the forward solve_ivp method.
+        Options for the forward solve_ivp method. The available options are:
+        * method: str
+            The IVP method: "rk4", "rk38", "rk23", or "rk45" (default).
+        * atol, rtol: float
+            The absolute and relative tolerances of the adaptive methods
+            ("rk23" and "rk45"). Default: 1e-8 and 1e-5.
+        * first_step: float
+            The size of the first step of the adaptive methods. It must be
+            positive. Default: the size of the first interval of `ts`.
     * bck_options: dict
-        Options for the backward solve_ivp method.
+        Options for the backward solve_ivp method. The options are the same
+        as `fwd_options` and default to them, except that `first_step`
+        defaults to the size of the last step of the forward solve if it is
+        adaptive.
 
     Returns
     -------
@@ -79,23 +90,14 @@ class _SolveIVP(torch.autograd.Function):
         config = set_default_option({
             "method": "rk45",
         }, fwd_options)
-        ctx.bck_config = set_default_option(config, bck_options)
+        ctx.bck_config = set_default_option(dict(config), bck_options)
 
         params = allparams[:nparams]
         objparams = allparams[nparams:]
 
-        orig_method = config.pop("method")
-        method = orig_method.lower()
-        try:
-            solver = {
-                "rk4": rk4_ivp,
-                "rk38": rk38_ivp,
-                "rk23": rk23_adaptive,
-                "rk45": rk45_adaptive,
-            }[method]
-        except KeyError:
-            raise RuntimeError("Unknown solve_ivp method: %s" % config["method"])
-        yt = solver(pfcn, ts, y0, params, **config)
+        solver = _get_ivp_solver(config.pop("method"))
+        stats = {}
+        yt = solver(pfcn, ts, y0, params, stats=stats, **config)
 
         # save the parameters for backward
         ctx.param_sep = TensorNonTensorSeparator(allparams, varonly=True)
@@ -105,6 +107,9 @@ class _SolveIVP(torch.autograd.Function):
         ctx.nparams = nparams
         ctx.yt = yt
         ctx.ts_requires_grad = ts.requires_grad
+        # the last step size of adaptive solvers is the initial guess of the
+        # step size of the backward solve which starts at the end of ts
+        ctx.last_step = stats.get("last_step", None)
 
         return yt
 
@@ -116,6 +121,9 @@ class _SolveIVP(torch.autograd.Function):
         param_sep = ctx.param_sep
         yt = ctx.yt
         ts_requires_grad = ctx.ts_requires_grad
+        bck_config = ctx.bck_config
+        if ctx.last_step is not None:
+            bck_config = set_default_option({"first_step": ctx.last_step}, bck_config)
 
         # restore the parameters
         saved_tensors = ctx.saved_tensors
@@ -129,20 +137,23 @@ class _SolveIVP(torch.autograd.Function):
 
         grad_enabled = torch.is_grad_enabled()
         # custom function to evaluate the input `pfcn` based on whether we want
-        # to connect the graph or not
-        def pfunc2(t, y, tensor_params):
-            if not grad_enabled:
+        # to connect the graph or not (decided once here instead of for every
+        # evaluation in the solver)
+        if not grad_enabled:
+            def pfunc2(t, y, tensor_params):
                 # if graph is not constructed, then use the default tensor_params
                 ycopy = y.detach().requires_grad_() # [yi.detach().requires_grad_() for yi in y]
-                tcopy = t.detach().requires_grad_()
+                # t only needs to be differentiated if ts requires grad
+                tcopy = t.detach().requires_grad_() if ts_requires_grad else t.detach()
                 f = pfcn(tcopy, ycopy, *params)
                 return f, tcopy, ycopy, tensor_params
-            else:
-                # if graph is constructed, then use the clone of the tensor params
+        else:
+            def pfunc2(t, y, tensor_params):
+                # if graph is constructed, then use the alias of the tensor params
                 # so that infinite loop of backward can be avoided
-                tensor_params_copy = [p.clone().requires_grad_() for p in tensor_params]
-                ycopy = y.clone().requires_grad_()
-                tcopy = t.clone().requires_grad_()
+                tensor_params_copy = [_differentiable_alias(p) for p in tensor_params]
+                ycopy = _differentiable_alias(y)
+                tcopy = _differentiable_alias(t) if ts_requires_grad else t
                 allparams_copy = param_sep.reconstruct_params(tensor_params_copy)
                 params_copy = allparams_copy[:nparams]
                 objparams_copy = allparams_copy[nparams:]
@@ -158,6 +169,7 @@ class _SolveIVP(torch.autograd.Function):
         dLdp_slice = slice(-ntensor_params, None, None) if ntensor_params > 0 else slice(0,0,None) # [-ntensor_params:]
         state_size = 3 + ntensor_params
         states = [None for _ in range(state_size)]
+        zero_t = torch.zeros_like(ts[0])
 
         def new_pfunc(t, states, *tensor_params):
             # t: single-element
@@ -165,14 +177,22 @@ class _SolveIVP(torch.autograd.Function):
             dLdy = -states[dLdy_index]
             with torch.enable_grad():
                 f, t2, y2, tensor_params2 = pfunc2(t, y, tensor_params)
-            allgradinputs = ([y2] + [t2] + list(tensor_params2))
+            # only differentiate w.r.t. t if the gradient of ts is required
+            if ts_requires_grad:
+                allgradinputs = ([y2] + [t2] + list(tensor_params2))
+            else:
+                allgradinputs = ([y2] + list(tensor_params2))
             allgrads = torch.autograd.grad(f,
                 inputs=allgradinputs,
                 grad_outputs=dLdy,
-                retain_graph=True,
                 allow_unused=True,
+                # the graph is retained as fcn may use tensors computed outside
+                # of it which graph is shared by all the evaluations
+                retain_graph=True,
                 create_graph=torch.is_grad_enabled()) # list of (*ny)
             allgrads = convert_none_grads_to_zeros(allgrads, allgradinputs)
+            if not ts_requires_grad:
+                allgrads = (allgrads[0], zero_t, *allgrads[1:])
             outs = (
                 f, # dydt
                 *allgrads,
@@ -180,37 +200,104 @@ class _SolveIVP(torch.autograd.Function):
             return outs
 
         ts_flip = ts.flip(0)
-        t_flip_idx = -1
-        states[y_index   ] = yt[t_flip_idx]
-        states[dLdy_index] = grad_yt[t_flip_idx]
-        states[dLdt_index] = torch.zeros_like(ts[0])
-        states[dLdp_slice] = [torch.zeros_like(tp) for tp in tensor_params]
-        grad_ts = [None for _ in range(len(ts))] if ts_requires_grad else None
+        # preallocated so the contributions are written in place instead of
+        # concatenated at the end
+        grad_ts = ts.new_zeros(len(ts)) if ts_requires_grad else None
 
-        for i in range(len(ts_flip)-1):
-            if ts_requires_grad:
-                feval = pfunc2(ts_flip[i], states[y_index], tensor_params)[0]
-                dLdt1 = torch.dot(feval.reshape(-1), grad_yt[t_flip_idx].reshape(-1))
-                states[dLdt_index] -= dLdt1
-                grad_ts[t_flip_idx] = dLdt1.reshape(-1)
-
-            t_flip_idx -= 1
-            outs = solve_ivp(new_pfunc, ts_flip[i:i+2], states, tensor_params,
-                fwd_options=ctx.bck_config, bck_options=ctx.bck_config)
-            # only take the output for the earliest time
-            states = [out[-1] for out in outs]
+        def reset_at_saved_point(i, states):
+            # apply the contribution of the saved point at ts_flip[i] to the
+            # augmented states
+            t_flip_idx = -1 - i
             states[y_index   ] = yt[t_flip_idx]
             # gyt is the contribution from the input grad_y
             # gy0 is the propagated gradients from the later time step
             states[dLdy_index] = grad_yt[t_flip_idx] + states[dLdy_index]
+            return states
+
+        def add_dLdt_at_saved_point(i, states, feval):
+            # feval is dy/dt evaluated at the saved point ts_flip[i]
+            t_flip_idx = -1 - i
+            dLdt1 = torch.dot(feval.reshape(-1), grad_yt[t_flip_idx].reshape(-1))
+            states[dLdt_index] = states[dLdt_index] - dLdt1
+            grad_ts[t_flip_idx] = dLdt1
+            return states
+
+        def apply_saved_point(i, states):
+            states = reset_at_saved_point(i, states)
+            if ts_requires_grad and i < len(ts_flip) - 1:
+                feval = pfunc2(ts_flip[i], states[y_index], tensor_params)[0]
+                states = add_dLdt_at_saved_point(i, states, feval)
+            return states
+
+        states[y_index   ] = yt[-1]
+        states[dLdy_index] = torch.zeros_like(grad_yt[-1])
+        states[dLdt_index] = torch.zeros_like(ts[0])
+        states[dLdp_slice] = [torch.zeros_like(tp) for tp in tensor_params]
+        states = apply_saved_point(0, states)
+
+        if not grad_enabled:
+            # the backward graph is not needed, so the adjoint is integrated
+            # with a single solver call through all the saved points, applying
+            # their contributions as the solver reaches them
+            packer = TensorPacker(states)
+
+            def flat_pfunc(t, ystates, *tensor_params):
+                return packer.flatten(new_pfunc(t, list(packer.pack(ystates)), *tensor_params))
+
+            def callback(i, ystates):
+                states = reset_at_saved_point(i, list(packer.pack(ystates)))
+                if i == len(ts_flip) - 1:
+                    return packer.flatten(states), None
+                # the derivatives of the augmented states do not depend on
+                # dL/dt, so the evaluation at the saved point gives both the
+                # dy/dt for dL/dt and the first stage of the next solver step
+                dstates = new_pfunc(ts_flip[i], states, *tensor_params)
+                if ts_requires_grad:
+                    states = add_dLdt_at_saved_point(i, states, dstates[y_index])
+                return packer.flatten(states), packer.flatten(dstates)
+
+            config = dict(bck_config)
+            solver = _get_ivp_solver(config.pop("method"))
+            # only the states at the end are needed, so the solver does not
+            # store the augmented states at every saved point
+            ystates = solver(flat_pfunc, ts_flip, packer.flatten(states), tensor_params,
+                callback=callback, last_only=True, **config)
+            states = list(packer.pack(ystates))
+        else:
+            # use the differentiable solve_ivp for each segment to construct the
+            # graph for higher order derivatives
+            for i in range(len(ts_flip)-1):
+                outs = solve_ivp(new_pfunc, ts_flip[i:i+2], states, tensor_params,
+                    fwd_options=bck_config, bck_options=bck_config)
+                # only take the output for the earliest time
+                for k, out in enumerate(outs):
+                    states[k] = out[-1]
+                states = apply_saved_point(i+1, states)
 
         if ts_requires_grad:
-            grad_ts[0] = states[dLdt_index].reshape(-1)
+            grad_ts[0] = states[dLdt_index]
 
         grad_y0 = states[dLdy_index] # dL/dy0, (*ny)
-        if ts_requires_grad:
-            grad_ts = torch.cat(grad_ts).view(*ts.shape)
         grad_tensor_params = states[dLdp_slice]
         grad_ntensor_params = [None for _ in range(len(allparams)-ntensor_params)]
         grad_params = param_sep.reconstruct_params(grad_tensor_params, grad_ntensor_params)
         return (None, grad_ts, None, None, None, grad_y0, *grad_params)
+
+def _differentiable_alias(x):
+    # returns a new tensor node that shares the memory with x and is connected
+    # to x in the graph (i.e. like x.clone(), but without copying the data)
+    if x.requires_grad:
+        return x.view_as(x)
+    else:
+        return x.detach().requires_grad_()
+
+def _get_ivp_solver(method):
+    try:
+        return {
+            "rk4": rk4_ivp,
+            "rk38": rk38_ivp,
+            "rk23": rk23_adaptive,
+            "rk45": rk45_adaptive,
+        }[method.lower()]
+    except KeyError:
+        raise RuntimeError("Unknown solve_ivp method: %s" % method)